@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from pirc522.analysis import (analyze_archive, archive_files, load_archive, access_conditions, value_blocks,
+                              default_key_sectors, clone_signals, default_keys)
+from pirc522.dump import CardDump, DumpStore, first_block, is_trailer, sector_blocks, sector_count, uid_string
+
+# Usage: AnalysisBenchmark.py [number of cards] [number of processes]
+cards = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+known_keys = [list(key) for key in default_keys]
+
+
+def random_bytes(rng, count):
+    return [rng.randrange(256) for _ in range(count)]
+
+
+def synthetic_card(uid, rng):
+    dump = CardDump(uid)
+    key = [0xFF] * 6 if rng.random() < 0.2 else random_bytes(rng, 6)
+    access = [0xFF, 0x07, 0x80] if rng.random() < 0.99 else [0xFF, 0x07, 0x00]  # 1% have broken access bits
+    for block in range(64):
+        if block == 0:
+            data = uid + [uid[0] ^ uid[1] ^ uid[2] ^ uid[3], 0x08, 0x04, 0x00] + random_bytes(rng, 8)
+        elif block % 4 == 3:
+            data = key + access + [0x69] + key
+        elif rng.random() < 0.1:
+            value = rng.randrange(-2 ** 31, 2 ** 31)
+            word = list(bytearray(value.to_bytes(4, "little", signed=True)))
+            data = word + [~byte & 0xFF for byte in word] + word + [block, ~block & 0xFF, block, ~block & 0xFF]
+        else:
+            data = random_bytes(rng, 16)
+        dump.set_block(block, data)
+    for sector in range(16):
+        dump.set_key(sector, 0x60, key)
+    return dump
+
+
+"""
+Clones planted into the corpus, 1% of cards each. Exact copies can't be told from the original.
+"""
+def synthetic_clone(original, kind, rng):
+    clone = CardDump.from_bytes(original.to_bytes())
+    if kind == 'block0':  # Manufacturer data of the clone's vendor
+        clone.set_block(0, list(clone.block(0))[:5] + random_bytes(rng, 11))
+    elif kind == 'bcc':
+        block0 = list(clone.block(0))
+        block0[4] ^= 0xFF
+        clone.set_block(0, block0)
+    elif kind == 'uid':
+        clone.set_block(0, random_bytes(rng, 4) + list(clone.block(0))[4:])
+    return clone
+
+
+"""
+Later snapshot of the same card after its keys were changed with RFIDUtil.write_trailer(), not a clone.
+"""
+def synthetic_rekeyed(original, rng):
+    snapshot = CardDump.from_bytes(original.to_bytes())
+    key = random_bytes(rng, 6)
+    for sector in range(16):
+        snapshot.set_key(sector, 0x60, key)
+        snapshot.set_block(first_block(sector) + 3, key + [0xFF, 0x07, 0x80, 0x69] + key)
+    return snapshot
+
+
+"""
+Same analysis as analyze_archive(), one card and one block at a time.
+"""
+def python_loop(paths):
+    summary = {'cards': 0, 'default_keys': [], 'bad_access': [], 'value_blocks': 0,
+               'bcc_mismatch': [], 'uid_mismatch': []}
+    fingerprints = {}
+    sector0_keys = {}
+    for path in paths:
+        dump = CardDump.load(path)
+        raw = path.endswith(".mfd")
+        block0 = list(dump.block(0))
+        reported = [] if raw else dump.uid
+        if dump.status[0]:
+            uid = block0[:4] if block0[0] ^ block0[1] ^ block0[2] ^ block0[3] == block0[4] else block0[:7]
+        else:
+            uid = reported
+        uid_hex = uid_string(uid)
+        summary['cards'] += 1
+
+        default_key, bad_access = False, False
+        keys = []
+        for sector in range(sector_count(dump.blocks)):
+            trailer = list(dump.block(first_block(sector) + sector_blocks(sector) - 1))
+            if raw:
+                keys.append((0x60, trailer[0:6]))
+            else:
+                keys.append(dump.keys[sector] or (0, [0] * 6))
+            if keys[-1][0] and keys[-1][1] in known_keys:
+                default_key = True
+            if not dump.status[first_block(sector) + sector_blocks(sector) - 1]:
+                continue
+            for stored in (trailer[0:6], trailer[10:16]):
+                if any(stored) and stored in known_keys:
+                    default_key = True
+            if ((trailer[6] & 0x0F) != (~trailer[7] >> 4) & 0x0F or (trailer[6] >> 4) != ~trailer[8] & 0x0F or
+                    (trailer[7] & 0x0F) != (~trailer[8] >> 4) & 0x0F):
+                bad_access = True
+        if default_key:
+            summary['default_keys'].append(uid_hex)
+        if bad_access:
+            summary['bad_access'].append(uid_hex)
+
+        for block in range(1, dump.blocks):
+            data = list(dump.block(block))
+            if not dump.status[block] or is_trailer(block):
+                continue
+            if (data[0:4] == data[8:12] and all(a == ~b & 0xFF for a, b in zip(data[0:4], data[4:8])) and
+                    data[12] == data[14] and data[13] == data[15] and data[12] == ~data[13] & 0xFF):
+                summary['value_blocks'] += 1
+
+        if dump.status[0]:
+            if len(reported) == 4 and reported[0] != 0x88:
+                if block0[0] ^ block0[1] ^ block0[2] ^ block0[3] != block0[4]:
+                    summary['bcc_mismatch'].append(uid_hex)
+                if reported != block0[:4]:
+                    summary['uid_mismatch'].append(uid_hex)
+            fingerprints.setdefault(uid_hex, set()).add(tuple(block0))
+        if keys[0][0]:
+            sector0_keys.setdefault(uid_hex, set()).add((keys[0][0], tuple(keys[0][1])))
+
+    summary['cloned'] = dict((uid, len(seen)) for uid, seen in fingerprints.items() if len(seen) > 1)
+    summary['key_changes'] = dict((uid, len(seen)) for uid, seen in sector0_keys.items() if len(seen) > 1)
+    return summary
+
+
+def vectorized(corpus):
+    return access_conditions(corpus), value_blocks(corpus), default_key_sectors(corpus), clone_signals(corpus)
+
+
+def timed(title, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    print("{0:<36} {1:8.3f} s".format(title, time.perf_counter() - start))
+    return result
+
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    try:
+        rng = random.Random(522)
+        store = DumpStore(directory)
+        start = time.perf_counter()
+        originals = [synthetic_card(random_bytes(rng, 4), rng) for _ in range(cards)]
+        for dump in originals:
+            store.save(dump)
+        planted = {}
+        for kind in ('exact', 'block0', 'bcc', 'uid'):
+            for original in rng.sample(originals, cards // 100):
+                store.save(synthetic_clone(original, kind, rng))
+                planted[kind] = planted.get(kind, 0) + 1
+        rekeyed = rng.sample(originals, cards // 100)
+        for original in rekeyed:
+            store.save(synthetic_rekeyed(original, rng))
+        for original in originals[:cards // 100]:  # Same cards exported as raw .mfd must look the same
+            original.save_mfd(os.path.join(directory, uid_string(original.uid) + ".mfd"))
+        print("Generated {0} dumps in {1:.3f} s".format(len(store) + cards // 100, time.perf_counter() - start))
+
+        paths = archive_files(directory)
+        expected = timed("Python loop", python_loop, paths)
+        summary = timed("Full analysis ({0} processes)".format(processes or os.cpu_count()),
+                        analyze_archive, paths, processes)
+        corpus = timed("Loading into arrays", load_archive, paths, processes)
+        timed("Vectorized checks on loaded arrays", vectorized, corpus)
+        assert summary == expected, "Vectorized analysis differs from the Python loop"
+
+        print("Cards: {0}, with default keys: {1}, broken access bits: {2}, value blocks: {3}".format(
+            summary['cards'], len(summary['default_keys']), len(summary['bad_access']), summary['value_blocks']))
+        print("Planted clones: {0}".format(planted))
+        print("Found: cloned UIDs {0}, BCC mismatches {1}, UID mismatches {2}".format(
+            len(summary['cloned']), len(summary['bcc_mismatch']), len(summary['uid_mismatch'])))
+        print("Rekeyed cards: {0}, found with changed keys: {1}".format(len(rekeyed), len(summary['key_changes'])))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+from pirc522 import RFID
+
+rdr = RFID()
+util = rdr.util()
+
+# Process every tag in the field once. Each tag is halted after the loop body, so it isn't picked up again
+for uid in util.cards():
+    print("Processing UID " + ":".join(["{:02x}".format(byte) for byte in uid]))
+    util.auth(rdr.auth_a, [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF])
+    util.rewrite(4, [None, None, 0x69, 0x24, 0x40])
+
+# Verification pass - wake halted tags with WUPA and check what was written
+for uid in util.cards(wake=True):
+    util.auth(rdr.auth_a, [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF])
+    util.read(4, silent=False)
+
+rdr.cleanup()
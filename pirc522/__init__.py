@@ -1,9 +1,24 @@
+import time
+
 import serial
 import serial.tools.list_ports
 
+from .metrics import RFIDMetrics, measured
+
 __version__ = "1.0.0"
 
 
+"""
+Clears bits of UID buffer beyond the first known_bits.
+"""
+def mask_known(uid, known_bits):
+    for i in range(len(uid)):
+        if i * 8 >= known_bits:
+            uid[i] = 0
+        elif (i + 1) * 8 > known_bits:
+            uid[i] &= (1 << (known_bits % 8)) - 1
+
+
 class RFID(object):
     mode_idle = 0x00
     mode_auth = 0x0E
@@ -32,7 +47,20 @@ class RFID(object):
     reg_tx_control = 0x14
     length = 16
 
+    # Timer settings per profile: (TModeReg, TPrescalerReg, TReloadReg high, TReloadReg low).
+    # With TPrescaler = 0xD3E one timer tick is ~0.5 ms.
+    timer_profiles = {
+        'poll': (0x8D, 0x3E, 0, 3),
+        'default': (0x8D, 0x3E, 0, 30),
+        'auth': (0x8D, 0x3E, 0, 60),
+        'write': (0x8D, 0x3E, 0, 60),
+        'halt': (0x8D, 0x3E, 0, 3),  # HLTA is never answered, so it always times out
+    }
+    timer_registers = (0x2A, 0x2B, 0x2C, 0x2D)
+
     authed = False
+    metrics = None
+    collision = None
 
     def __init__(self, dev=None, output_func=print):
         self.output = output_func
@@ -68,19 +96,34 @@ class RFID(object):
         else:
             self.output("Found unknown MFRC522, trying to continue...")
 
-        self.dev_write(0x2A, 0x8D)
-        self.dev_write(0x2B, 0x3E)
-        self.dev_write(0x2D, 30)
-        self.dev_write(0x2C, 0)
+        self.timer_stats = dict((name, [0, 0]) for name in self.timer_profiles)
+        self.set_timer_profile('default')
         self.dev_write(0x15, 0x40)
         self.dev_write(0x11, 0x3D)
         self.switch_antenna(True)
         self.connected = True
 
+    """
+    Starts collecting register access and command metrics into RFIDMetrics object, which is returned.
+    """
+    def enable_metrics(self):
+        if self.metrics is None:
+            self.metrics = RFIDMetrics()
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
     def dev_write(self, address, value):
         command = address & ~(1 << 7)
         self.serial.write(serial.to_bytes([command, value]))
-        response = self.serial.read(1)
+        if self.metrics is None:
+            response = self.serial.read(1)
+        else:
+            self.metrics.register_write(address)
+            start = time.perf_counter()
+            response = self.serial.read(1)
+            self.metrics.serial_waited(time.perf_counter() - start)
         if not response:
             self.output("dev_write: Timeout exceeded. Just silence...")
             return False
@@ -92,7 +135,13 @@ class RFID(object):
     def dev_read(self, address):
         command = address | (1 << 7)
         self.serial.write(serial.to_bytes([command]))
-        return self.serial.read(1)[0]
+        if self.metrics is None:
+            return self.serial.read(1)[0]
+        self.metrics.register_read(address)
+        start = time.perf_counter()
+        response = self.serial.read(1)
+        self.metrics.serial_waited(time.perf_counter() - start)
+        return response[0]
 
     def set_bitmask(self, address, mask):
         current = self.dev_read(address)
@@ -110,7 +159,51 @@ class RFID(object):
         else:
             self.clear_bitmask(self.reg_tx_control, 0x03)
 
-    def card_write(self, command, data):
+    """
+    Writes timer registers of the named profile from timer_profiles.
+    Only registers whose values differ from the ones written before are rewritten,
+    failed writes are retried with the next call.
+    """
+    def set_timer_profile(self, name):
+        if name == self.timer_profile:
+            return
+        values = self.timer_profiles[name]
+        written = True
+        for i, address in enumerate(self.timer_registers):
+            if self.timer_values[i] != values[i]:
+                if self.dev_write(address, values[i]):
+                    self.timer_values[i] = values[i]
+                else:
+                    written = False
+        self.timer_profile = name if written else None
+
+    """
+    Picks timer profile for the command which is going to be sent to the card.
+    """
+    def timer_profile_for(self, command, data):
+        if command == self.mode_auth:
+            return 'auth'
+        if data and data[0] in (self.act_reqidl, self.act_reqall):
+            return 'poll'
+        if data and data[0] == self.act_end:
+            return 'halt'
+        if data and data[0] == self.act_write:
+            return 'write'
+        return 'default'
+
+    """
+    Returns dict of {profile: (commands, timeouts)} counted by card_write().
+    """
+    def timer_timeouts(self):
+        return dict((name, tuple(stats)) for name, stats in self.timer_stats.items())
+
+    """
+    Sends command with data to the card.
+    timer_profile -- name from timer_profiles, picked by timer_profile_for() if None
+    allow_collision -- read data on collision error too, storing CollReg into self.collision
+    Returns tuple of (error state, received data, number of received bits).
+    """
+    def card_write(self, command, data, timer_profile=None, allow_collision=False):
         back_data = []
         back_length = 0
         error = False
@@ -125,6 +218,12 @@ class RFID(object):
             irq = 0x77
             irq_wait = 0x30
 
+        if timer_profile is None:
+            timer_profile = self.timer_profile_for(command, data)
+        self.set_timer_profile(timer_profile)
+        stats = self.timer_stats[timer_profile]
+        stats[0] += 1
+
         self.dev_write(0x02, irq | 0x80)
         self.clear_bitmask(0x04, 0x80)
         self.set_bitmask(0x0A, 0x80)
@@ -146,12 +245,21 @@ class RFID(object):
                 break  # Got it!
             if n & 0x01:
                 error = True
+                stats[1] += 1
+                if self.metrics is not None:
+                    self.metrics.timeout()
                 break  # The timer decrements the timer value in register TCounterValReg to zero
 
         self.clear_bitmask(0x0D, 0x80)
 
+        self.collision = None
         if not error:
-            if (self.dev_read(0x06) & 0x1B) == 0x00:
+            error_mask = 0x1B
+            error_reg = self.dev_read(0x06)
+            if allow_collision and error_reg & 0x08:
+                self.collision = self.dev_read(0x0E)
+                error_mask = 0x13
+            if (error_reg & error_mask) == 0x00:
                 error = False
 
                 if n & irq & 0x01:
@@ -181,35 +289,88 @@ class RFID(object):
     Requests for tag.
     Returns False if no tag is present, otherwise returns (True, tag_type)
     """
+    @measured('request', lambda result: not result[0])
     def request(self, req_mode=0x26):
         self.dev_write(0x0D, 0x07)
-        error, back_data, back_bits = self.card_write(self.mode_transrec, [req_mode, ])
+        # ATQA of several tags may collide, they are told apart by anti_collision()
+        error, back_data, back_bits = self.card_write(self.mode_transrec, [req_mode, ], allow_collision=True)
         if error or (back_bits != 0x10):
             return False, back_bits
         return True, back_bits
 
     """
-    Anti-collision detection.
-    Returns tuple of (success, tag_ID).
+    Bit-oriented anti-collision (cascade level 1). Tags must be in READY state after request() or wake().
+    known_bits, known_uid -- UID bits already known, the tag whose UID starts with them is searched for
+    If several tags answer, the one with 1 at the first collided bit is chosen.
+    Returns tuple of (success, tag_ID, branches), where branches is list of (known_bits, known_uid) leading
+    to the other tags, for the bits chosen on collisions.
     """
-    def anti_collision(self):
-        uid_check = 0
+    def anti_collision_branches(self, known_bits=0, known_uid=None):
+        uid = (list(known_uid or []) + [0] * 5)[:5]
+        branches = []
+        self.clear_bitmask(0x0E, 0x80)  # Clear bits received after collision
+
+        while True:
+            full_bytes, last_bits = known_bits // 8, known_bits % 8
+            mask_known(uid, known_bits)
+            nvb = ((2 + full_bytes) << 4) | last_bits
+            buf = [self.act_anticl, nvb] + uid[:full_bytes + (1 if last_bits else 0)]
+            self.dev_write(0x0D, (last_bits << 4) | last_bits)  # RxAlign and TxLastBits
+            error, response, back_bits = self.card_write(self.mode_transrec, buf, allow_collision=True)
+            if error or not response:
+                self.dev_write(0x0D, 0x00)
+                return False, uid[:4], branches
+
+            # The first received byte continues the partially sent one
+            for i, byte in enumerate(response[:5 - full_bytes]):
+                if i == 0 and last_bits:
+                    byte = (uid[full_bytes] & ((1 << last_bits) - 1)) | (byte & (0xFF << last_bits) & 0xFF)
+                uid[full_bytes + i] = byte
+
+            if self.collision is None:
+                break
+            position = self.collision & 0x1F or 32
+            if self.collision & 0x20 or known_bits + position > 32:
+                self.dev_write(0x0D, 0x00)
+                return False, uid[:4], branches
+            known_bits += position
+            branch = list(uid)
+            mask_known(branch, known_bits - 1)
+            branches.append((known_bits, branch))  # Collided bit is 0 in this branch
+            uid[(known_bits - 1) // 8] |= 1 << ((known_bits - 1) % 8)
+
         self.dev_write(0x0D, 0x00)
+        if uid[0] ^ uid[1] ^ uid[2] ^ uid[3] != uid[4]:
+            return False, uid[:4], branches
+        return True, uid[:4], branches
 
-        error, response, back_bits = self.card_write(self.mode_transrec, [self.act_anticl, 0x20])
-        if error:
-            return False, response
-        if len(response) == 5:
-            uid = response[:4]
-            check_byte = response[4]
-            for byte in uid:
-                uid_check = uid_check ^ byte
-            if uid_check != check_byte:
-                return False, response
-        else:
-            return False, response
-        return True, uid
+    """
+    Anti-collision detection.
+    Returns tuple of (success, tag_ID).
+    """
+    @measured('anti_collision', lambda result: not result[0])
+    def anti_collision(self, known_bits=0, known_uid=None):
+        success, uid, branches = self.anti_collision_branches(known_bits, known_uid)
+        return success, uid
 
+    """
+    Walks the anti-collision tree to find UIDs of all tags in the field.
+    Tags must be in READY state after request() or wake(), they stay there.
+    Returns list of tag IDs.
+    """
+    @measured('anti_collision', lambda result: not result)
+    def anti_collision_all(self):
+        uids = []
+        pending = [(0, None)]
+        while pending:
+            known_bits, known_uid = pending.pop()
+            success, uid, branches = self.anti_collision_branches(known_bits, known_uid)
+            pending += branches
+            if success and uid not in uids:
+                uids.append(uid)
+        return uids
+
+    @measured('calculate_crc', lambda result: False)
     def calculate_crc(self, data):
         self.clear_bitmask(0x05, 0x04)
         self.set_bitmask(0x0A, 0x80)
@@ -231,7 +392,9 @@ class RFID(object):
     uid -- list or tuple with four bytes tag ID
     Returns True if succeed.
     """
+    @measured('select_tag', lambda result: not result)
     def select_tag(self, uid):
+        self.dev_write(0x0D, 0x00)
         buf = [self.act_select, 0x70] + uid
         uid_check = 0
         for byte in uid:
@@ -253,6 +416,7 @@ class RFID(object):
     uid -- list or tuple with four bytes tag ID
     Returns True in case of success.
     """
+    @measured('card_auth', lambda result: not result)
     def card_auth(self, auth_mode, block_address, key, uid):
         buf = [auth_mode, block_address] + key + uid
         error, back_data, back_length = self.card_write(self.mode_auth, buf)
@@ -268,10 +432,19 @@ class RFID(object):
         self.clear_bitmask(0x08, 0x08)
         self.authed = False
 
+    """
+    Wakes up all tags in the field, including halted ones (WUPA).
+    Returns same as request().
+    """
+    def wake(self):
+        return self.request(self.act_reqall)
+
     """Switch state to HALT"""
     def halt(self):
+        buf = [self.act_end, 0]
+        buf += self.calculate_crc(buf)
         self.clear_bitmask(0x08, 0x80)
-        self.card_write(self.mode_transrec, [self.act_end, 0])
+        self.card_write(self.mode_transrec, buf)
         self.clear_bitmask(0x08, 0x08)
         self.authed = False
 
@@ -279,6 +452,7 @@ class RFID(object):
     Reads data from block. You should be authenticated before calling read.
     Returns tuple of (error state, read data).
     """
+    @measured('read', lambda result: result[0])
     def read(self, block_address):
         buf = [self.act_read, block_address]
         buf += self.calculate_crc(buf)
@@ -293,6 +467,7 @@ class RFID(object):
     Writes data to block. You should be authenticated before calling write.
     Returns True if succeed.
     """
+    @measured('write', lambda result: not result)
     def write(self, block_address, data):
         buf = [self.act_write, block_address]
         buf += self.calculate_crc(buf)
@@ -306,12 +481,17 @@ class RFID(object):
                 buf_w.append(data[i])
 
             buf_w += self.calculate_crc(buf_w)
-            error, back_data, back_length = self.card_write(self.mode_transrec, buf_w)
+            error, back_data, back_length = self.card_write(self.mode_transrec, buf_w, 'write')
             if not (back_length == 4) or not ((back_data[0] & 0x0F) == 0x0A):
                 error = True
         return not error
 
+    """
+    Soft resets the chip. Timer registers get chip defaults, so they are rewritten by the next command.
+    """
     def reset(self):
+        self.timer_profile = None
+        self.timer_values = [None] * len(self.timer_registers)
         return self.dev_write(0x01, self.mode_reset)
 
     """
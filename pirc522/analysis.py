@@ -0,0 +1,321 @@
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from .dump import extension, first_block, layout, sector_blocks, sector_count
+
+default_keys = np.array([
+    [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF],
+    [0x00, 0x00, 0x00, 0x00, 0x00, 0x00],
+    [0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5],
+    [0xB0, 0xB1, 0xB2, 0xB3, 0xB4, 0xB5],
+    [0xD3, 0xF7, 0xD3, 0xF7, 0xD3, 0xF7],
+], dtype=np.uint8)
+
+
+"""
+Card dumps loaded into arrays:
+uids -- (cards, 10) UID bytes read from the manufacturer block (see block0_uids()), uid_lengths -- (cards, )
+reported_uids -- (cards, 10) UID answered in anti-collision, reported_lengths -- (cards, ), 0 for raw .mfd
+data -- (cards, blocks, 16) block contents, status -- (cards, blocks) True if block was read
+keys -- (cards, sectors, 6) keys used to read sectors, key_types -- (cards, sectors), 0 if sector wasn't read
+Cards with less blocks than the others (1K among 4K) are padded with unread blocks.
+"""
+class Corpus(object):
+    def __init__(self, cards, blocks):
+        sectors = sector_count(blocks)
+        self.blocks = blocks
+        self.uids = np.zeros((cards, 10), dtype=np.uint8)
+        self.uid_lengths = np.zeros(cards, dtype=np.uint8)
+        self.reported_uids = np.zeros((cards, 10), dtype=np.uint8)
+        self.reported_lengths = np.zeros(cards, dtype=np.uint8)
+        self.timestamps = np.zeros(cards, dtype=np.float64)
+        self.data = np.zeros((cards, blocks, 16), dtype=np.uint8)
+        self.status = np.zeros((cards, blocks), dtype=bool)
+        self.keys = np.zeros((cards, sectors, 6), dtype=np.uint8)
+        self.key_types = np.zeros((cards, sectors), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.uids)
+
+    def uid_strings(self):
+        return ["".join(["{:02x}".format(byte) for byte in uid[:length]])
+                for uid, length in zip(self.uids, self.uid_lengths)]
+
+    """
+    Joins corpora into one, padding them to the largest number of blocks.
+    """
+    @classmethod
+    def concatenate(cls, parts):
+        parts = list(parts)
+        blocks = max([part.blocks for part in parts] or [64])
+        corpus = cls(sum(len(part) for part in parts), blocks)
+        start = 0
+        for part in parts:
+            end = start + len(part)
+            sectors = part.keys.shape[1]
+            corpus.uids[start:end] = part.uids
+            corpus.uid_lengths[start:end] = part.uid_lengths
+            corpus.reported_uids[start:end] = part.reported_uids
+            corpus.reported_lengths[start:end] = part.reported_lengths
+            corpus.timestamps[start:end] = part.timestamps
+            corpus.data[start:end, :part.blocks] = part.data
+            corpus.status[start:end, :part.blocks] = part.status
+            corpus.keys[start:end, :sectors] = part.keys
+            corpus.key_types[start:end, :sectors] = part.key_types
+            start = end
+        return corpus
+
+
+"""
+Returns list of dump files (.rcd and raw .mfd) in directory.
+"""
+def archive_files(directory):
+    return sorted([os.path.join(directory, name) for name in os.listdir(directory)
+                   if os.path.splitext(name)[1] in (extension, ".mfd")])
+
+
+"""
+Loads dump files into Corpus in the current process.
+Raw .mfd images get key A from their sector trailers as the keys used to read them.
+"""
+def load_files(paths):
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            files.append((data, layout(data)))
+        except ValueError as e:
+            raise ValueError(path + ": " + str(e))
+    corpus = Corpus(len(files), max([item[1][0] for item in files] or [64]))
+    trailers = trailer_blocks(corpus.blocks)
+    for i, (data, dump_layout) in enumerate(files):
+        blocks, uid, timestamp, keys_offset, sectors, status_offset, image_offset = dump_layout
+        raw = np.frombuffer(data, dtype=np.uint8)
+        corpus.timestamps[i] = timestamp
+        corpus.data[i, :blocks] = raw[image_offset:image_offset + blocks * 16].reshape(-1, 16)
+        if status_offset is None:
+            corpus.status[i, :blocks] = True
+            sectors = sector_count(blocks)
+            corpus.key_types[i, :sectors] = 0x60
+            corpus.keys[i, :sectors] = corpus.data[i, trailers[:sectors], 0:6]
+            continue
+
+        corpus.reported_uids[i, :len(uid)] = uid
+        corpus.reported_lengths[i] = len(uid)
+        keys = raw[keys_offset:keys_offset + sectors * 7].reshape(-1, 7)
+        corpus.key_types[i, :sectors] = keys[:, 0]
+        corpus.keys[i, :sectors] = keys[:, 1:]
+        corpus.status[i, :blocks] = raw[status_offset:image_offset] != 0
+    corpus.uids, corpus.uid_lengths = block0_uids(corpus)
+    return corpus
+
+
+"""
+Reads UIDs from manufacturer blocks, the same way for raw .mfd images and dumps with header.
+UID has 4 bytes if the fifth byte is their BCC (XOR), otherwise it's taken as 7 bytes long.
+Reported UID is used for dumps without block 0 read.
+Returns tuple of (uids, uid_lengths).
+"""
+def block0_uids(corpus):
+    block0 = corpus.data[:, 0]
+    read = corpus.status[:, 0]
+    four = np.bitwise_xor.reduce(block0[:, :4], axis=1) == block0[:, 4]
+    uids = np.zeros_like(corpus.reported_uids)
+    uids[:, :7] = block0[:, :7]
+    uids[four, 4:] = 0
+    lengths = np.where(four, 4, 7).astype(np.uint8)
+    return (np.where(read[:, None], uids, corpus.reported_uids),
+            np.where(read, lengths, corpus.reported_lengths).astype(np.uint8))
+
+
+def chunks(paths, chunk_size):
+    return [list(paths[i:i + chunk_size]) for i in range(0, len(paths), chunk_size)]
+
+
+"""
+Loads dump files (or all dumps in directory) spreading them across a process pool.
+processes -- number of worker processes, os.cpu_count() by default
+"""
+def load_archive(paths, processes=None, chunk_size=256):
+    if isinstance(paths, str):
+        paths = archive_files(paths)
+    with Pool(processes) as pool:
+        return Corpus.concatenate(pool.map(load_files, chunks(list(paths), chunk_size)))
+
+
+"""
+Returns array of sector trailer block addresses for card with specified number of blocks.
+"""
+def trailer_blocks(blocks):
+    return np.array([first_block(sector) + sector_blocks(sector) - 1 for sector in range(sector_count(blocks))])
+
+
+"""
+Decodes access bits of sector trailers (bytes 6-8, see RFIDUtil.write_trailer).
+Returns tuple of (conditions, valid):
+conditions -- (cards, sectors, 4) access condition C1C2C3 as number 0-7 for block groups 0-2 and trailer
+valid -- (cards, sectors) True if trailer was read and its inverted bits match
+"""
+def access_conditions(corpus):
+    trailers = trailer_blocks(corpus.blocks)
+    bits = corpus.data[:, trailers, 6:9]
+    b6, b7, b8 = bits[..., 0], bits[..., 1], bits[..., 2]
+    shifts = np.arange(4, dtype=np.uint8)
+    c1 = (b7[..., None] >> (shifts + 4)) & 1
+    c2 = (b8[..., None] >> shifts) & 1
+    c3 = (b8[..., None] >> (shifts + 4)) & 1
+    conditions = (c1 << 2) | (c2 << 1) | c3
+
+    valid = corpus.status[:, trailers]
+    valid &= (b6 & 0x0F) == ((~b7 >> 4) & 0x0F)
+    valid &= (b6 >> 4) == (~b8 & 0x0F)
+    valid &= (b7 & 0x0F) == ((~b8 >> 4) & 0x0F)
+    return conditions, valid
+
+
+"""
+Returns (cards, sectors) array, True where key A or key B of the sector is one of keys.
+Both the key used to read the sector and keys stored in the trailer are checked.
+Zero keys in the trailer are ignored, that's what the card returns instead of unreadable keys.
+"""
+def default_key_sectors(corpus, keys=default_keys):
+    trailers = trailer_blocks(corpus.blocks)
+    trailer = corpus.data[:, trailers]
+
+    def matches(candidates):
+        return (candidates[..., None, :] == keys).all(axis=-1).any(axis=-1)
+
+    def stored_matches(candidates):
+        return matches(candidates) & candidates.any(axis=-1)
+
+    read = corpus.status[:, trailers]
+    found = read & (stored_matches(trailer[..., 0:6]) | stored_matches(trailer[..., 10:16]))
+    found |= (corpus.key_types != 0) & matches(corpus.keys)
+    return found
+
+
+"""
+Decodes value blocks. Returns tuple of (values, valid), both of (cards, blocks) shape.
+Manufacturer block, trailers and unread blocks are never valid.
+"""
+def value_blocks(corpus):
+    words = corpus.data.view("<i4")
+    data = corpus.data
+    valid = corpus.status.copy()
+    valid[:, 0] = False
+    valid[:, trailer_blocks(corpus.blocks)] = False
+    valid &= (words[..., 0] == words[..., 2]) & (words[..., 0] == ~words[..., 1])
+    valid &= (data[..., 12] == data[..., 14]) & (data[..., 13] == data[..., 15])
+    valid &= data[..., 12] == ~data[..., 13]
+    return words[..., 0], valid
+
+
+"""
+Returns unique rows of UID and manufacturer block for cards whose block 0 was read.
+"""
+def fingerprint_rows(corpus):
+    read = corpus.status[:, 0]
+    rows = np.concatenate([corpus.uids, corpus.uid_lengths[:, None], corpus.data[:, 0]], axis=1)[read]
+    return np.unique(rows, axis=0)
+
+
+"""
+Returns unique rows of UID and the key type and key used for sector 0 for cards whose sector 0 was read.
+"""
+def key_rows(corpus):
+    read = corpus.key_types[:, 0] != 0
+    rows = np.concatenate([corpus.uids, corpus.uid_lengths[:, None],
+                           corpus.key_types[:, :1], corpus.keys[:, 0]], axis=1)[read]
+    return np.unique(rows, axis=0)
+
+
+"""
+Returns dict of {UID: number of different rows} for UIDs with more than one different row.
+rows -- result of fingerprint_rows() or key_rows(), UID and its length come first
+"""
+def varying_uids(rows):
+    rows = np.unique(rows, axis=0)
+    uids, counts = np.unique(rows[:, :11], axis=0, return_counts=True)
+    return dict(("".join(["{:02x}".format(byte) for byte in uid[:uid[10]]]), int(count))
+                for uid, count in zip(uids, counts) if count > 1)
+
+
+"""
+Returns dict of {UID: number of different manufacturer blocks} for UIDs seen with more than one.
+rows -- result of fingerprint_rows()
+Magic cards copying block 0 byte for byte look exactly like the original in dumps and can't be found
+this way, see clone_signals() for the checks of a single dump.
+"""
+def cloned_uids(rows):
+    return varying_uids(rows)
+
+
+"""
+Returns dict of {UID: number of different sector 0 keys} for UIDs read with more than one key.
+rows -- result of key_rows()
+Those are key rotations (see RFIDUtil.write_trailer) or dumps read with key A and key B, not clones.
+"""
+def key_changes(rows):
+    return varying_uids(rows)
+
+
+"""
+Checks manufacturer blocks against UIDs answered by cards in anti-collision.
+Returns tuple of (bcc_mismatch, uid_mismatch), both of (cards, ) shape:
+bcc_mismatch -- fifth byte of block 0 is not XOR of the 4-byte UID
+uid_mismatch -- UID in block 0 differs from the answered one
+Raw .mfd images and 7-byte UIDs (answered with cascade tag 0x88) are never flagged.
+"""
+def clone_signals(corpus):
+    block0 = corpus.data[:, 0]
+    checked = corpus.status[:, 0] & (corpus.reported_lengths == 4) & (corpus.reported_uids[:, 0] != 0x88)
+    bcc_mismatch = checked & (np.bitwise_xor.reduce(block0[:, :4], axis=1) != block0[:, 4])
+    uid_mismatch = checked & (corpus.reported_uids[:, :4] != block0[:, :4]).any(axis=1)
+    return bcc_mismatch, uid_mismatch
+
+
+def analyze_files(paths):
+    corpus = load_files(paths)
+    uids = np.array(corpus.uid_strings(), dtype=object)
+    conditions, access_valid = access_conditions(corpus)
+    read_trailers = corpus.status[:, trailer_blocks(corpus.blocks)]
+    values, value_valid = value_blocks(corpus)
+    bcc_mismatch, uid_mismatch = clone_signals(corpus)
+    return {
+        'cards': len(corpus),
+        'default_keys': list(uids[default_key_sectors(corpus).any(axis=1)]),
+        'bad_access': list(uids[(read_trailers & ~access_valid).any(axis=1)]),
+        'value_blocks': int(value_valid.sum()),
+        'bcc_mismatch': list(uids[bcc_mismatch]),
+        'uid_mismatch': list(uids[uid_mismatch]),
+        'fingerprint_rows': fingerprint_rows(corpus),
+        'key_rows': key_rows(corpus),
+    }
+
+
+"""
+Analyzes dump files (or all dumps in directory) across a process pool.
+Returns dict with number of cards, UIDs of cards with default keys, UIDs of cards with broken access bits,
+number of value blocks, UIDs of cards failing clone_signals() checks, cloned UIDs (see cloned_uids())
+and UIDs with changed keys (see key_changes()).
+"""
+def analyze_archive(paths, processes=None, chunk_size=256):
+    if isinstance(paths, str):
+        paths = archive_files(paths)
+    with Pool(processes) as pool:
+        parts = pool.map(analyze_files, chunks(list(paths), chunk_size))
+    rows = [part['fingerprint_rows'] for part in parts]
+    keys = [part['key_rows'] for part in parts]
+    return {
+        'cards': sum(part['cards'] for part in parts),
+        'default_keys': [uid for part in parts for uid in part['default_keys']],
+        'bad_access': [uid for part in parts for uid in part['bad_access']],
+        'value_blocks': sum(part['value_blocks'] for part in parts),
+        'bcc_mismatch': [uid for part in parts for uid in part['bcc_mismatch']],
+        'uid_mismatch': [uid for part in parts for uid in part['uid_mismatch']],
+        'cloned': cloned_uids(np.concatenate(rows)) if rows else {},
+        'key_changes': key_changes(np.concatenate(keys)) if keys else {},
+    }
@@ -0,0 +1,275 @@
+import mmap
+import os
+import struct
+import time
+
+# Header: magic, number of blocks, UID length, number of sectors, timestamp, UID.
+# It is followed by key table (key type and 6 key bytes per sector, type 0 if sector wasn't read),
+# read status (one byte per block, 1 if block was read) and raw .mfd image.
+header = struct.Struct("<4sHBBd10s")
+magic = b"RCD1"
+extension = ".rcd"
+block_size = 16
+
+
+"""
+Returns number of sectors of card with specified number of blocks (64 for 1K, 256 for 4K).
+"""
+def sector_count(blocks):
+    if blocks <= 128:
+        return blocks // 4
+    return 32 + (blocks - 128) // 16
+
+
+"""
+Returns first block address of sector. Sectors 32-39 of 4K card have 16 blocks.
+"""
+def first_block(sector):
+    if sector < 32:
+        return sector * 4
+    return 128 + (sector - 32) * 16
+
+
+def sector_blocks(sector):
+    return 4 if sector < 32 else 16
+
+
+def sector_of(block_address):
+    if block_address < 128:
+        return block_address // 4
+    return 32 + (block_address - 128) // 16
+
+
+def is_trailer(block_address):
+    sector = sector_of(block_address)
+    return block_address == first_block(sector) + sector_blocks(sector) - 1
+
+
+def uid_string(uid):
+    return "".join(["{:02x}".format(byte) for byte in uid])
+
+
+"""
+Checks dump data (bytes, mmap or other buffer) and returns its layout as tuple of
+(blocks, UID, timestamp, keys offset, sectors, status offset, image offset).
+For raw .mfd image offsets of keys and status are None and UID is taken from the manufacturer block:
+it has 4 bytes if the fifth byte is their BCC, 7 bytes otherwise.
+Raises ValueError if data isn't a card dump.
+"""
+def layout(data):
+    if len(data) in (1024, 4096):
+        block0 = bytearray(data[0:block_size])
+        uid_length = 4 if block0[0] ^ block0[1] ^ block0[2] ^ block0[3] == block0[4] else 7
+        return len(data) // block_size, block0[:uid_length], 0, None, 0, None, 0
+    if len(data) < header.size:
+        raise ValueError("Not a card dump: too short")
+    file_magic, blocks, uid_length, sectors, timestamp, uid = header.unpack_from(data)
+    if file_magic != magic:
+        raise ValueError("Not a card dump: bad magic")
+    status_offset = header.size + sectors * 7
+    image_offset = status_offset + blocks
+    if len(data) != image_offset + blocks * block_size:
+        raise ValueError("Not a card dump: size doesn't match header")
+    return blocks, bytearray(uid[:uid_length]), timestamp, header.size, sectors, status_offset, image_offset
+
+
+class CardDump(object):
+    def __init__(self, uid, blocks=64, timestamp=None):
+        self.uid = list(uid)
+        self.blocks = blocks
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.image = bytearray(blocks * block_size)
+        self.status = bytearray(blocks)
+        self.keys = [None] * sector_count(blocks)
+
+    """
+    Stores contents of block. data is None if block was not read.
+    """
+    def set_block(self, block_address, data):
+        if data is None:
+            self.status[block_address] = 0
+            return
+        offset = block_address * block_size
+        self.image[offset:offset + block_size] = bytearray(data[:block_size])
+        self.status[block_address] = 1
+
+    def block(self, block_address):
+        offset = block_address * block_size
+        return self.image[offset:offset + block_size]
+
+    """
+    Stores key used to read the sector.
+    auth_method -- RFID.auth_a or RFID.auth_b
+    """
+    def set_key(self, sector, auth_method, key):
+        self.keys[sector] = (auth_method, list(key[:6]))
+
+    def header_size(self):
+        return header.size + len(self.keys) * 7 + self.blocks
+
+    """
+    Returns standard raw 1K/4K image.
+    """
+    def mfd(self):
+        return bytes(self.image)
+
+    def to_bytes(self):
+        uid = bytes(bytearray(self.uid))
+        data = bytearray(header.pack(magic, self.blocks, len(uid), len(self.keys), self.timestamp, uid))
+        for key in self.keys:
+            if key is None:
+                data += bytearray(7)
+            else:
+                data += bytearray([key[0]] + key[1])
+        data += self.status
+        data += self.image
+        return bytes(data)
+
+    """
+    Parses dump. Raw .mfd images without header are accepted too - all blocks are then marked as read
+    and UID is taken from the manufacturer block.
+    """
+    @classmethod
+    def from_bytes(cls, data):
+        blocks, uid, timestamp, keys_offset, sectors, status_offset, image_offset = layout(data)
+        dump = cls(uid, blocks, timestamp)
+        for sector in range(sectors):
+            entry = bytearray(data[keys_offset + sector * 7:keys_offset + sector * 7 + 7])
+            if entry[0]:
+                dump.keys[sector] = (entry[0], list(entry[1:]))
+        if status_offset is None:
+            dump.status[:] = bytearray([1]) * blocks
+        else:
+            dump.status[:] = data[status_offset:image_offset]
+        dump.image[:] = data[image_offset:image_offset + blocks * block_size]
+        return dump
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    def save_mfd(self, path):
+        with open(path, "wb") as f:
+            f.write(self.mfd())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+    """
+    Returns list of block addresses which differ from other dump, including blocks read only in one of them.
+    """
+    def diff(self, other):
+        return diff_images(self.image, self.status, other.image, other.status)
+
+
+"""
+Compares two images with their read status, returns list of differing block addresses.
+"""
+def diff_images(image, status, other_image, other_status):
+    blocks = min(len(image), len(other_image)) // block_size
+    changed = []
+    size = blocks * block_size
+    if image[:size] != other_image[:size] or status[:blocks] != other_status[:blocks]:
+        for i in range(blocks):
+            block = slice(i * block_size, (i + 1) * block_size)
+            if status[i] != other_status[i] or image[block] != other_image[block]:
+                changed.append(i)
+    changed += range(blocks, max(len(image), len(other_image)) // block_size)
+    return changed
+
+
+"""
+Directory of dumps named <uid>-<timestamp in ms>.rcd. Only file names are scanned on start,
+dumps are memory-mapped when compared.
+"""
+class DumpStore(object):
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.index = {}
+        self.rescan()
+
+    def rescan(self):
+        self.index = {}
+        for entry in os.listdir(self.directory):
+            name, ext = os.path.splitext(entry)
+            if ext != extension or "-" not in name:
+                continue
+            uid, stamp = name.rsplit("-", 1)
+            try:
+                stamp = int(stamp)
+            except ValueError:
+                continue
+            self.index.setdefault(uid, []).append((stamp, os.path.join(self.directory, entry)))
+        for snapshots in self.index.values():
+            snapshots.sort()
+
+    def __len__(self):
+        return sum(len(snapshots) for snapshots in self.index.values())
+
+    def uids(self):
+        return list(self.index.keys())
+
+    """
+    Returns paths of all snapshots of card with specified UID, oldest first.
+    """
+    def find(self, uid):
+        if not isinstance(uid, str):
+            uid = uid_string(uid)
+        return [path for stamp, path in self.index.get(uid.lower(), [])]
+
+    def latest(self, uid):
+        paths = self.find(uid)
+        return paths[-1] if paths else None
+
+    def load(self, path):
+        return CardDump.load(path)
+
+    """
+    Saves dump as new snapshot. Returns its path.
+    """
+    def save(self, dump):
+        uid = uid_string(dump.uid)
+        stamp = int(dump.timestamp * 1000)
+        snapshots = self.index.setdefault(uid, [])
+        while any(stamp == existing for existing, path in snapshots):
+            stamp += 1
+        path = os.path.join(self.directory, "{0}-{1}{2}".format(uid, stamp, extension))
+        dump.save(path)
+        snapshots.append((stamp, path))
+        snapshots.sort()
+        return path
+
+    """
+    Compares dump with stored snapshot (the latest one of the same UID by default).
+    Returns list of changed block addresses or None if there is no snapshot to compare with.
+    Raises ValueError if the snapshot isn't a card dump.
+    """
+    def diff(self, dump, path=None):
+        if path is None:
+            path = self.latest(dump.uid)
+            if path is None:
+                return None
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError("Not a card dump: " + path + " is empty")
+            stored = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with memoryview(stored) as view:
+                blocks, uid, timestamp, keys_offset, sectors, status_offset, image_offset = layout(view)
+                image = view[image_offset:image_offset + blocks * block_size]
+                if status_offset is None:
+                    status = bytearray([1]) * blocks
+                else:
+                    status = view[status_offset:image_offset]
+                try:
+                    return diff_images(dump.image, dump.status, image, status)
+                finally:
+                    image.release()
+                    if isinstance(status, memoryview):
+                        status.release()
+        finally:
+            stored.close()
@@ -0,0 +1,161 @@
+import time
+
+
+class RFIDMetrics(object):
+    # Upper bounds of latency histogram buckets, seconds
+    buckets = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+    commands = ('request', 'anti_collision', 'select_tag', 'card_auth', 'read', 'write', 'calculate_crc')
+
+    def __init__(self):
+        self.reset()
+
+    """
+    Drops all collected values.
+    """
+    def reset(self):
+        self.reads = {}
+        self.writes = {}
+        self.serial_wait = 0.0
+        self.serial_waits = 0
+        self.latency = dict((name, [0] * (len(self.buckets) + 1)) for name in self.commands)
+        self.latency_sum = dict((name, 0.0) for name in self.commands)
+        self.calls = dict((name, 0) for name in self.commands)
+        self.errors = dict((name, 0) for name in self.commands)
+        self.timeouts = dict((name, 0) for name in self.commands + ('other', ))
+        self.running = []
+
+    def register_read(self, address):
+        self.reads[address] = self.reads.get(address, 0) + 1
+
+    def register_write(self, address):
+        self.writes[address] = self.writes.get(address, 0) + 1
+
+    def serial_waited(self, seconds):
+        self.serial_wait += seconds
+        self.serial_waits += 1
+
+    """
+    Called by card_write() when the chip timer fires. Timeout is assigned to the innermost measured command
+    which is running, or to 'other' if there is none (e.g. halt() or direct card_write() calls).
+    """
+    def timeout(self):
+        self.timeouts[self.running[-1] if self.running else 'other'] += 1
+
+    def begin(self, name):
+        self.running.append(name)
+
+    def end(self):
+        self.running.pop()
+
+    """
+    Records a finished command.
+    name -- one of commands
+    seconds -- duration of the command
+    failed -- True if the command returned an error
+    """
+    def command(self, name, seconds, failed):
+        histogram = self.latency[name]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[-1] += 1
+        self.latency_sum[name] += seconds
+        self.calls[name] += 1
+        if failed:
+            self.errors[name] += 1
+
+    """
+    Returns all collected values as dict.
+    Histograms are lists of non-cumulative counts per bucket, the last one is +Inf.
+    """
+    def as_dict(self):
+        return {
+            'register_reads': dict(self.reads),
+            'register_writes': dict(self.writes),
+            'serial_wait_seconds': self.serial_wait,
+            'serial_waits': self.serial_waits,
+            'buckets': list(self.buckets),
+            'commands': dict((name, {
+                'calls': self.calls[name],
+                'errors': self.errors[name],
+                'timeouts': self.timeouts[name],
+                'latency_sum': self.latency_sum[name],
+                'latency': list(self.latency[name]),
+            }) for name in self.commands),
+            'other_timeouts': self.timeouts['other'],
+        }
+
+    """
+    Returns all collected values in Prometheus text exposition format.
+    """
+    def prometheus(self, prefix='rc522'):
+        lines = []
+
+        def metric(name, kind, doc):
+            lines.append("# HELP {0}_{1} {2}".format(prefix, name, doc))
+            lines.append("# TYPE {0}_{1} {2}".format(prefix, name, kind))
+
+        metric('register_reads_total', 'counter', "Register reads by address.")
+        for address in sorted(self.reads):
+            lines.append('{0}_register_reads_total{{address="{1:#04x}"}} {2}'.format(
+                prefix, address, self.reads[address]))
+        metric('register_writes_total', 'counter', "Register writes by address.")
+        for address in sorted(self.writes):
+            lines.append('{0}_register_writes_total{{address="{1:#04x}"}} {2}'.format(
+                prefix, address, self.writes[address]))
+
+        metric('serial_wait_seconds_total', 'counter', "Time spent waiting for serial responses.")
+        lines.append("{0}_serial_wait_seconds_total {1!r}".format(prefix, self.serial_wait))
+        metric('serial_waits_total', 'counter', "Number of serial responses waited for.")
+        lines.append("{0}_serial_waits_total {1}".format(prefix, self.serial_waits))
+
+        metric('command_seconds', 'histogram', "Card command latency.")
+        for name in self.commands:
+            cumulative = 0
+            bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, self.latency[name]):
+                cumulative += count
+                lines.append('{0}_command_seconds_bucket{{command="{1}",le="{2}"}} {3}'.format(
+                    prefix, name, bound, cumulative))
+            lines.append('{0}_command_seconds_sum{{command="{1}"}} {2!r}'.format(
+                prefix, name, self.latency_sum[name]))
+            lines.append('{0}_command_seconds_count{{command="{1}"}} {2}'.format(
+                prefix, name, self.calls[name]))
+
+        metric('command_errors_total', 'counter', "Card commands finished with an error.")
+        for name in self.commands:
+            lines.append('{0}_command_errors_total{{command="{1}"}} {2}'.format(
+                prefix, name, self.errors[name]))
+        metric('command_timeouts_total', 'counter', "Chip timer timeouts during card commands.")
+        for name in self.commands + ('other', ):
+            lines.append('{0}_command_timeouts_total{{command="{1}"}} {2}'.format(
+                prefix, name, self.timeouts[name]))
+
+        return "\n".join(lines) + "\n"
+
+
+"""
+Decorates RFID method to report its latency and error state to RFID.metrics, if metrics are enabled.
+failed -- function returning True if result of the method means an error
+"""
+def measured(name, failed):
+    def decorator(method):
+        def wrapper(self, *args, **kwargs):
+            if self.metrics is None:
+                return method(self, *args, **kwargs)
+            metrics = self.metrics
+            metrics.begin(name)
+            start = time.perf_counter()
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                metrics.end()
+            metrics.command(name, time.perf_counter() - start, failed(result))
+            return result
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+    return decorator
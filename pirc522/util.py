@@ -1,3 +1,5 @@
+from .dump import CardDump, first_block, sector_blocks, is_trailer, sector_of
+
 
 class RFIDUtil(object):
     rfid = None
@@ -15,14 +17,15 @@ class RFIDUtil(object):
     Returns block address of spec. block in spec. sector.
     """
     def block_addr(self, sector, block):
-        return sector * 4 + block
+        return first_block(sector) + block
 
     """
     Returns sector and it's block representation of block address, e.g.
     S01B03 for sector trailer in second sector.
     """
     def sector_string(self, block_address):
-        return "S%dB%d" % ((block_address - (block_address % 4)) / 4, block_address % 4)
+        sector = sector_of(block_address)
+        return "S%dB%d" % (sector, block_address - first_block(sector))
 
     """
     Sets tag for further operations.
@@ -142,11 +145,84 @@ class RFIDUtil(object):
                 self.output("Error on " + self.sector_string(block_address))
         return error, data
 
-    def dump(self, sectors=16, start_from=0):
-        dump_range = range(start_from * 4, start_from * 4 + sectors * 4)
-        for i in dump_range:
-            if i % 4 == 0 and i > 0:
+    """
+    Iterates over tags in the field, yielding UID of each one after it's set with set_tag().
+    When the loop body is done with the tag, it's halted, so REQA doesn't pick it up again.
+    wake -- start with WUPA instead of REQA to wake halted tags too, e.g. for a verification pass
+    misses -- stop after this many rounds in a row without a processed tag
+    Each round finds all tags answering the request with RFID.anti_collision_all(). Selecting one of them
+    sends the others back to IDLE, or to HALT if they were woken by WUPA, so the request is repeated
+    before selecting the next one.
+    """
+    def cards(self, wake=False, misses=3):
+        req_mode = self.rfid.act_reqall if wake else self.rfid.act_reqidl
+        seen = []
+        missed = 0
+        while missed < misses:
+            success, data = self.rfid.request(req_mode)
+            found = self.rfid.anti_collision_all() if success else []
+            new = [uid for uid in found if uid not in seen]
+            # Processed tags which weren't halted. WUPA wakes all processed tags, so they aren't checked then
+            stale = [] if req_mode == self.rfid.act_reqall else [uid for uid in found if uid in seen]
+            processed, failed = False, False
+
+            for i, uid in enumerate(new + stale):
+                if i > 0 and not self.rfid.request(req_mode)[0]:
+                    break
+                if uid in stale:
+                    if self.rfid.select_tag(uid):
+                        self.rfid.halt()
+                    continue
+
+                if not self.set_tag(uid):
+                    self.uid = None  # Not seen, so it's retried in the next round
+                    failed = True
+                    if self.debug:
+                        self.output("Failed to select UID " + ":".join(["{:02x}".format(byte) for byte in uid]))
+                    continue
+                seen.append(uid)
+                processed = True
+                try:
+                    yield uid
+                finally:
+                    self.rfid.halt()  # Sent before Crypto1 is stopped, authenticated tag ignores plain HLTA
+                    self.method = None
+                    self.key = None
+                    self.last_auth = None
+                    self.uid = None
+            missed = 0 if processed else missed + 1
+            if not failed:  # Tag woken by WUPA went back to HALT if its select failed
+                req_mode = self.rfid.act_reqidl
+
+    """
+    Reads sectors of the tag, prints them unless silent. Tag and auth must be set - does auth.
+    Returns CardDump with raw 1K image (4K one if sectors above 15 are read) and saves it to path if given.
+    Sectors 32-39 of 4K card have 16 blocks.
+    """
+    def dump(self, sectors=16, start_from=0, silent=False, path=None):
+        if start_from < 0 or sectors < 0 or start_from + sectors > 40:
+            raise ValueError("Sectors {0}-{1} are out of card range, it has 40 sectors at most".format(
+                start_from, start_from + sectors - 1))
+        card = CardDump(self.uid or [], 64 if start_from + sectors <= 16 else 256)
+        for sector in range(start_from, start_from + sectors):
+            if sector > start_from and not silent:
                 self.output()
-            self.read(i, silent=False)
+            first = first_block(sector)
+            for i in range(first, first + sector_blocks(sector)):
+                error, data = self.read(i, silent=silent)
+                if error or data is None:
+                    card.set_block(i, None)
+                    continue
+                if is_trailer(i):
+                    data = list(data)
+                    if self.method == self.rfid.auth_a:
+                        data[0:6] = self.key[:6]
+                    else:
+                        data[10:16] = self.key[:6]
+                card.set_block(i, data)
+                card.set_key(sector, self.method, self.key)
+        if path:
+            card.save(path)
+        return card
 
 